@@ -114,6 +114,7 @@ const MachineLearningAnalytics = ({ userId, baseCurrency }) => {
         
         // Send transaction data to ML service for prediction
         const mlResponse = await axios.post('http://34.44.184.196:5001/api/ml/predict', {
+          userId,
           transactions: transactionsData
         });
         console.log('ML response:', mlResponse.data);
@@ -586,6 +587,7 @@ const BudgetRecommendations = ({ userId, baseCurrency }) => {
         
         // Send transaction data to ML service for budget recommendations
         const mlResponse = await axios.post('http://34.44.184.196:5001/api/ml/budget', {
+          userId,
           transactions: transactionsData
         });
         
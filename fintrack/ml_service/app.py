@@ -8,6 +8,8 @@ import joblib
 import os
 import logging
 from datetime import datetime, timedelta
+from scheduler import (ResultStore, PrecomputeScheduler, InsufficientDataError,
+                       transactions_fingerprint, transaction_ids)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -19,6 +21,9 @@ logger = logging.getLogger(__name__)
 # Models cache
 models = {}
 
+class InvalidRequestError(Exception):
+    """Raised when a request body has invalid fields"""
+
 def handle_sparse_data(transactions):
     """
     Handle sparse data from 2019 only by creating synthetic data points
@@ -74,139 +79,149 @@ def handle_sparse_data(transactions):
     
     return df
 
-@app.route('/api/ml/predict', methods=['POST'])
-def predict_spending():
+def build_predictions(transactions):
     """
     Predict future spending based on historical transaction data.
+    Raises InsufficientDataError if there is nothing to predict from.
     """
-    try:
-        # Get transaction data from request
-        data = request.json
-        transactions = data.get('transactions', [])
+    # Process data accounting for sparsity
+    df = handle_sparse_data(transactions)
+    
+    if df.empty:
+        raise InsufficientDataError('No valid transaction data after processing')
+    
+    # Ensure amount is numeric
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
+    # Feature engineering
+    df['amount_abs'] = df['amount'].abs()
+    df['month_sin'] = np.sin(2 * np.pi * df['month']/12)
+    df['month_cos'] = np.cos(2 * np.pi * df['month']/12)
+    df['day_sin'] = np.sin(2 * np.pi * df['day']/31)
+    df['day_cos'] = np.cos(2 * np.pi * df['day']/31)
+    
+    # Process features by category
+    predictions = {}
+    category_trends = {}
+    
+    for category in df['category_name'].unique():
+        category_data = df[df['category_name'] == category]
         
-        if not transactions:
-            return jsonify({'error': 'No transaction data provided'}), 400
+        # Only predict if we have sufficient data points
+        if len(category_data) >= 3:
+            # Features for prediction
+            X = category_data[['month_sin', 'month_cos', 'day_sin', 'day_cos', 'year']]
+            y = category_data['amount_abs']
             
-        # Process data accounting for sparsity
-        df = handle_sparse_data(transactions)
-        
-        if df.empty:
-            return jsonify({'error': 'No valid transaction data after processing'}), 400
-        
-        # Ensure amount is numeric
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-        # Feature engineering
-        df['amount_abs'] = df['amount'].abs()
-        df['month_sin'] = np.sin(2 * np.pi * df['month']/12)
-        df['month_cos'] = np.cos(2 * np.pi * df['month']/12)
-        df['day_sin'] = np.sin(2 * np.pi * df['day']/31)
-        df['day_cos'] = np.cos(2 * np.pi * df['day']/31)
-        
-        # Process features by category
-        predictions = {}
-        category_trends = {}
-        
-        for category in df['category_name'].unique():
-            category_data = df[df['category_name'] == category]
+            # Train Random Forest model
+            model = RandomForestRegressor(n_estimators=50, random_state=42)
+            model.fit(X, y)
             
-            # Only predict if we have sufficient data points
-            if len(category_data) >= 3:
-                # Features for prediction
-                X = category_data[['month_sin', 'month_cos', 'day_sin', 'day_cos', 'year']]
-                y = category_data['amount_abs']
-                
-                # Train Random Forest model
-                model = RandomForestRegressor(n_estimators=50, random_state=42)
-                model.fit(X, y)
-                
-                # Store model for future use
-                models[category] = model
+            # Store model for future use
+            models[category] = model
+            
+            # Predict next 3 months
+            next_months = []
+            today = datetime.now()
+            
+            for i in range(1, 4):
+                future_date = today + timedelta(days=30*i)
+                month = future_date.month
+                day = future_date.day
+                year = future_date.year
                 
-                # Predict next 3 months
-                next_months = []
-                today = datetime.now()
+                features = np.array([[
+                    np.sin(2 * np.pi * month/12),
+                    np.cos(2 * np.pi * month/12),
+                    np.sin(2 * np.pi * day/31),
+                    np.cos(2 * np.pi * day/31),
+                    year
+                ]])
                 
-                for i in range(1, 4):
-                    future_date = today + timedelta(days=30*i)
-                    month = future_date.month
-                    day = future_date.day
-                    year = future_date.year
-                    
-                    features = np.array([[
-                        np.sin(2 * np.pi * month/12),
-                        np.cos(2 * np.pi * month/12),
-                        np.sin(2 * np.pi * day/31),
-                        np.cos(2 * np.pi * day/31),
-                        year
-                    ]])
-                    
-                    prediction = float(model.predict(features)[0])
-                    next_months.append({
-                        'month': future_date.strftime('%B %Y'),
-                        'value': prediction
-                    })
+                prediction = float(model.predict(features)[0])
+                next_months.append({
+                    'month': future_date.strftime('%B %Y'),
+                    'value': prediction
+                })
+            
+            # Calculate trend
+            if len(category_data) >= 10:
+                # Sort by date to get chronological order
+                sorted_data = category_data.sort_values('date')
+                recent_avg = sorted_data.iloc[-5:]['amount_abs'].mean()
+                earlier_avg = sorted_data.iloc[-10:-5]['amount_abs'].mean()
                 
-                # Calculate trend
-                if len(category_data) >= 10:
-                    # Sort by date to get chronological order
-                    sorted_data = category_data.sort_values('date')
-                    recent_avg = sorted_data.iloc[-5:]['amount_abs'].mean()
-                    earlier_avg = sorted_data.iloc[-10:-5]['amount_abs'].mean()
-                    
-                    if earlier_avg > 0:
-                        percent_change = ((recent_avg - earlier_avg) / earlier_avg) * 100
-                        trend = 'increasing' if percent_change > 0 else 'decreasing'
-                        trend_percent = abs(int(percent_change))
-                    else:
-                        trend = 'stable'
-                        trend_percent = 0
+                if earlier_avg > 0:
+                    percent_change = ((recent_avg - earlier_avg) / earlier_avg) * 100
+                    trend = 'increasing' if percent_change > 0 else 'decreasing'
+                    trend_percent = abs(int(percent_change))
                 else:
-                    trend = 'unknown'
+                    trend = 'stable'
                     trend_percent = 0
+            else:
+                trend = 'unknown'
+                trend_percent = 0
+            
+            category_trends[category] = {
+                'trend': trend,
+                'trendPercent': trend_percent
+            }
                 
-                category_trends[category] = {
-                    'trend': trend,
-                    'trendPercent': trend_percent
-                }
-                    
-                predictions[category] = next_months
-        
-        # Calculate total predicted spending by month
-        total_by_month = {}
-        
-        for category, months in predictions.items():
-            for month_data in months:
-                month_name = month_data['month']
-                if month_name not in total_by_month:
-                    total_by_month[month_name] = 0
-                total_by_month[month_name] += month_data['value']
+            predictions[category] = next_months
+    
+    # Calculate total predicted spending by month
+    total_by_month = {}
+    
+    for category, months in predictions.items():
+        for month_data in months:
+            month_name = month_data['month']
+            if month_name not in total_by_month:
+                total_by_month[month_name] = 0
+            total_by_month[month_name] += month_data['value']
+    
+    monthly_predictions = [
+        {'month': month, 'totalPredicted': amount}
+        for month, amount in total_by_month.items()
+    ]
+    
+    # Sort by chronological order
+    monthly_predictions.sort(key=lambda x: 
+        datetime.strptime(x['month'], '%B %Y'))
+    
+    # Detect spending anomalies
+    anomalies = detect_anomalies(df)
         
-        monthly_predictions = [
-            {'month': month, 'totalPredicted': amount}
-            for month, amount in total_by_month.items()
-        ]
+    return {
+        'categoryPredictions': [
+            {
+                'category': category,
+                'predictions': predictions[category],
+                'trend': category_trends.get(category, {}).get('trend', 'unknown'),
+                'trendPercent': category_trends.get(category, {}).get('trendPercent', 0)
+            }
+            for category in predictions
+        ],
+        'monthlyPredictions': monthly_predictions,
+        'anomalies': anomalies
+    }
+
+@app.route('/api/ml/predict', methods=['POST'])
+def predict_spending():
+    """
+    Predict future spending based on historical transaction data.
+    Serves the precomputed result when the user's transactions are unchanged.
+    """
+    try:
+        # Get transaction data from request
+        data = request.json
+        transactions = data.get('transactions', [])
         
-        # Sort by chronological order
-        monthly_predictions.sort(key=lambda x: 
-            datetime.strptime(x['month'], '%B %Y'))
+        if not transactions:
+            return jsonify({'error': 'No transaction data provided'}), 400
         
-        # Detect spending anomalies
-        anomalies = detect_anomalies(df)
-            
-        return jsonify({
-            'categoryPredictions': [
-                {
-                    'category': category,
-                    'predictions': predictions[category],
-                    'trend': category_trends.get(category, {}).get('trend', 'unknown'),
-                    'trendPercent': category_trends.get(category, {}).get('trendPercent', 0)
-                }
-                for category in predictions
-            ],
-            'monthlyPredictions': monthly_predictions,
-            'anomalies': anomalies
-        })
+        return serve_section(data.get('userId'), 'predictions', transactions)
         
+    except (InvalidRequestError, InsufficientDataError) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.exception("Error in prediction endpoint")
         return jsonify({'error': str(e)}), 500
@@ -252,10 +267,82 @@ def detect_anomalies(df):
     
     return anomalies[:10]  # Return top 10 anomalies
 
+def build_budget_recommendations(transactions):
+    """
+    Generate budget recommendations based on historical spending.
+    Raises InsufficientDataError if there is nothing to recommend from.
+    """
+    # Process data accounting for sparsity
+    df = handle_sparse_data(transactions)
+    
+    if df.empty:
+        raise InsufficientDataError('No valid transaction data after processing')
+    
+    # Ensure amount is numeric and create amount_abs
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
+    df['amount_abs'] = df['amount'].abs()
+    
+    # Extract expense transactions only
+    expenses_df = df[df['transaction_type'] == 'Expense']
+    
+    # Group transactions by category and month
+    expenses_df['month_year'] = expenses_df['date'].dt.strftime('%Y-%m')
+    category_monthly = expenses_df.groupby(['category_name', 'month_year'])['amount_abs'].sum().reset_index()
+    
+    # Get distinct categories and months
+    categories = expenses_df['category_name'].unique()
+    month_years = expenses_df['month_year'].unique()
+    
+    recommendations = []
+    
+    for category in categories:
+        category_data = category_monthly[category_monthly['category_name'] == category]
+        
+        if len(category_data) >= 2:  # At least 2 months of data
+            # Calculate statistics
+            amounts = category_data['amount_abs']
+            avg_spending = float(amounts.mean())
+            std_dev = float(amounts.std() if len(amounts) > 1 else amounts.mean() * 0.1)
+            cv = std_dev / avg_spending if avg_spending > 0 else 1
+            
+            # Determine consistency
+            if cv < 0.3:
+                consistency = 'High'
+            elif cv < 0.6:
+                consistency = 'Medium'
+            else:
+                consistency = 'Low'
+            
+            # Calculate recommended budget with buffer based on consistency
+            if consistency == 'High':
+                buffer = 1.1  # 10% buffer for consistent spending
+            elif consistency == 'Medium':
+                buffer = 1.2  # 20% buffer for medium consistency
+            else:
+                buffer = 1.3  # 30% buffer for inconsistent spending
+            
+            recommended_budget = avg_spending * buffer
+            
+            recommendations.append({
+                'category': category,
+                'avgSpending': avg_spending,
+                'recommendedBudget': recommended_budget,
+                'consistency': consistency,
+                'months': len(category_data)
+            })
+    
+    # Sort by average spending (highest first)
+    recommendations.sort(key=lambda x: x['avgSpending'], reverse=True)
+    
+    return {
+        'recommendations': recommendations
+    }
+
 @app.route('/api/ml/budget', methods=['POST'])
 def recommend_budget():
     """
     Generate budget recommendations based on historical spending.
+    Serves the precomputed result when the user's transactions are unchanged.
     """
     try:
         # Get transaction data from request
@@ -264,75 +351,102 @@ def recommend_budget():
         
         if not transactions:
             return jsonify({'error': 'No transaction data provided'}), 400
-            
-        # Process data accounting for sparsity
-        df = handle_sparse_data(transactions)
-        
-        if df.empty:
-            return jsonify({'error': 'No valid transaction data after processing'}), 400
-        
-        # Ensure amount is numeric and create amount_abs
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-        df['amount_abs'] = df['amount'].abs()
-        
-        # Extract expense transactions only
-        expenses_df = df[df['transaction_type'] == 'Expense']
         
-        # Group transactions by category and month
-        expenses_df['month_year'] = expenses_df['date'].dt.strftime('%Y-%m')
-        category_monthly = expenses_df.groupby(['category_name', 'month_year'])['amount_abs'].sum().reset_index()
+        return serve_section(data.get('userId'), 'budget', transactions)
         
-        # Get distinct categories and months
-        categories = expenses_df['category_name'].unique()
-        month_years = expenses_df['month_year'].unique()
-        
-        recommendations = []
+    except (InvalidRequestError, InsufficientDataError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in budget recommendation endpoint")
+        return jsonify({'error': str(e)}), 500
+
+# Precomputed results, refreshed off-peak by the scheduler
+PRECOMPUTE_ENABLED = os.environ.get('ML_PRECOMPUTE_ENABLED', '1') == '1'
+# Shared secret the Node server sends to /activity; unset disables the check
+SERVICE_TOKEN = os.environ.get('ML_SERVICE_TOKEN')
+result_store = ResultStore()
+scheduler = PrecomputeScheduler(
+    {
+        'predictions': build_predictions,
+        'budget': build_budget_recommendations
+    },
+    result_store,
+    max_workers=int(os.environ.get('ML_PRECOMPUTE_WORKERS', 2)),
+    offpeak_start=int(os.environ.get('ML_OFFPEAK_START', 1)),
+    offpeak_end=int(os.environ.get('ML_OFFPEAK_END', 6)),
+    poll_interval=int(os.environ.get('ML_PRECOMPUTE_INTERVAL', 300)),
+    max_pending=int(os.environ.get('ML_MAX_PENDING', 1000)),
+    result_max_age_days=int(os.environ.get('ML_RESULT_MAX_AGE_DAYS', 30))
+)
+
+def parse_user_id(value):
+    """
+    Validate a userId from a request body. Raises InvalidRequestError unless it is an integer.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise InvalidRequestError('userId must be an integer')
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidRequestError('userId must be an integer')
+
+def serve_section(user_id, section, transactions):
+    """
+    Return a stored result if it is still fresh for these transactions,
+    otherwise compute it now and store it for next time.
+    """
+    build = scheduler.compute_functions[section]
+    if user_id is None:
+        return jsonify(build(transactions))
+    
+    user_id = parse_user_id(user_id)
+    if not scheduler.is_registered(user_id):
+        # Only users the Node server registered through /activity get stored results
+        return jsonify(build(transactions))
+    
+    fingerprint = transactions_fingerprint(transactions)
+    stored = result_store.lookup(user_id, section, fingerprint)
+    cached = stored is not None
+    if not cached:
+        try:
+            result, error = build(transactions), None
+        except InsufficientDataError as e:
+            result, error = None, str(e)
+        stored = result_store.save_section(user_id, section, fingerprint, result,
+                                           transaction_ids(transactions), error=error)
+    
+    # Queues any section that is still stale, or drops the job if none are
+    scheduler.record_activity(user_id, transactions, viewed=True)
+    
+    if stored.get('error'):
+        raise InsufficientDataError(stored['error'])
+    return jsonify(dict(stored['result'], computedAt=stored['computedAt'], cached=cached))
+
+@app.route('/api/ml/activity', methods=['POST'])
+def record_activity():
+    """
+    Register a user's latest transactions so the scheduler can
+    precompute their results before the next visit.
+    Only the Node server should call this, using the shared ML_SERVICE_TOKEN.
+    """
+    try:
+        if SERVICE_TOKEN and request.headers.get('X-ML-Token') != SERVICE_TOKEN:
+            return jsonify({'error': 'Unauthorized'}), 401
         
-        for category in categories:
-            category_data = category_monthly[category_monthly['category_name'] == category]
-            
-            if len(category_data) >= 2:  # At least 2 months of data
-                # Calculate statistics
-                amounts = category_data['amount_abs']
-                avg_spending = float(amounts.mean())
-                std_dev = float(amounts.std() if len(amounts) > 1 else amounts.mean() * 0.1)
-                cv = std_dev / avg_spending if avg_spending > 0 else 1
-                
-                # Determine consistency
-                if cv < 0.3:
-                    consistency = 'High'
-                elif cv < 0.6:
-                    consistency = 'Medium'
-                else:
-                    consistency = 'Low'
-                
-                # Calculate recommended budget with buffer based on consistency
-                if consistency == 'High':
-                    buffer = 1.1  # 10% buffer for consistent spending
-                elif consistency == 'Medium':
-                    buffer = 1.2  # 20% buffer for medium consistency
-                else:
-                    buffer = 1.3  # 30% buffer for inconsistent spending
-                
-                recommended_budget = avg_spending * buffer
-                
-                recommendations.append({
-                    'category': category,
-                    'avgSpending': avg_spending,
-                    'recommendedBudget': recommended_budget,
-                    'consistency': consistency,
-                    'months': len(category_data)
-                })
+        data = request.json
+        transactions = data.get('transactions', [])
         
-        # Sort by average spending (highest first)
-        recommendations.sort(key=lambda x: x['avgSpending'], reverse=True)
+        if data.get('userId') is None or not transactions:
+            return jsonify({'error': 'userId and transactions are required'}), 400
         
-        return jsonify({
-            'recommendations': recommendations
-        })
+        user_id = parse_user_id(data.get('userId'))
+        scheduler.record_activity(user_id, transactions)
+        return jsonify({'status': 'recorded', 'scheduler': scheduler.status()})
         
+    except InvalidRequestError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logger.exception("Error in budget recommendation endpoint")
+        logger.exception("Error in activity endpoint")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/ml/health', methods=['GET'])
@@ -340,7 +454,14 @@ def health_check():
     """
     Simple health check endpoint.
     """
-    return jsonify({'status': 'healthy', 'service': 'ML prediction service'})
+    return jsonify({
+        'status': 'healthy',
+        'service': 'ML prediction service',
+        'scheduler': scheduler.status()
+    })
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
+    # With the debug reloader only the child process serves requests
+    if PRECOMPUTE_ENABLED and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        scheduler.start()
+    app.run(debug=True, host='0.0.0.0', port=5001)
@@ -0,0 +1,14 @@
+# gunicorn.conf.py
+# Used by run.sh: gunicorn -c gunicorn.conf.py app:app
+bind = '0.0.0.0:5001'
+
+# The precompute queue lives in memory, so keep a single worker process
+# and serve concurrent requests with threads instead
+workers = 1
+threads = 4
+
+def post_fork(server, worker):
+    """Start the precompute scheduler in the worker that serves requests"""
+    from app import scheduler, PRECOMPUTE_ENABLED
+    if PRECOMPUTE_ENABLED:
+        scheduler.start()
@@ -2,4 +2,5 @@
 # run.sh
 cd "$(dirname "$0")"
 source venv/bin/activate
-python app.py
\ No newline at end of file
+# gunicorn.conf.py starts the precompute scheduler in the worker
+gunicorn -c gunicorn.conf.py app:app
\ No newline at end of file
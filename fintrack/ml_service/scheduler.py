@@ -0,0 +1,316 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+class InsufficientDataError(Exception):
+    """Raised by a compute function when the transactions cannot produce a result"""
+
+def transactions_fingerprint(transactions):
+    """
+    Return a stable hash of a user's transactions so we can tell whether
+    anything changed since the last computation.
+    """
+    rows = sorted(
+        (
+            str(t.get('transaction_id', '')),
+            str(t.get('transaction_date', '')),
+            str(t.get('amount', '')),
+            str(t.get('category_name', '')),
+            str(t.get('transaction_type', ''))
+        )
+        for t in transactions
+    )
+    return hashlib.sha1(json.dumps(rows).encode('utf-8')).hexdigest()
+
+def transaction_ids(transactions):
+    """Return the sorted transaction ids, used to count new transactions"""
+    return sorted(str(t.get('transaction_id', '')) for t in transactions)
+
+def is_fresh(entry, fingerprint, today=None):
+    """
+    Check whether a stored section was computed from the same transactions
+    on the same day. Forecasts are relative to the current date, so results
+    from an earlier day are stale even if the transactions are unchanged.
+    """
+    if not entry or entry.get('fingerprint') != fingerprint:
+        return False
+    # Not having enough data only changes when the transactions do
+    if entry.get('error'):
+        return True
+    today = today or date.today()
+    return entry.get('computedAt', '')[:10] == today.isoformat()
+
+class ResultStore:
+    """
+    Local JSON store of precomputed results, one file per user.
+    Each section (predictions, budget) keeps the fingerprint of the
+    transactions it was computed from and a computedAt timestamp.
+    """
+
+    def __init__(self, directory=RESULTS_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, user_id):
+        # user_id is forced to an int so it can never escape the directory
+        return os.path.join(self.directory, f'user_{int(user_id)}.json')
+
+    def exists(self, user_id):
+        """Check whether anything is stored for a user"""
+        return os.path.exists(self._path(user_id))
+
+    def load(self, user_id):
+        """Return everything stored for a user, or an empty dict"""
+        path = self._path(user_id)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f"Could not read stored results for user {user_id}")
+            return {}
+
+    def save_section(self, user_id, section, fingerprint, result,
+                     transaction_ids=(), error=None):
+        """
+        Write one section for a user, keeping the others intact, and return it.
+        If the section could not be computed, result is None and error says why.
+        """
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            data = self.load(user_id)
+            data[section] = {
+                'fingerprint': fingerprint,
+                'computedAt': datetime.now().isoformat(timespec='seconds'),
+                'transactionIds': list(transaction_ids),
+                'result': result
+            }
+            if error:
+                data[section]['error'] = error
+            # Write to a temp file first so readers never see a partial file
+            tmp_path = self._path(user_id) + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self._path(user_id))
+            return data[section]
+
+    def lookup(self, user_id, section, fingerprint, today=None):
+        """Return the stored section if it is still fresh for the given fingerprint"""
+        entry = self.load(user_id).get(section)
+        if is_fresh(entry, fingerprint, today):
+            return entry
+        return None
+
+    def prune(self, max_age_days):
+        """Delete result files not written for max_age_days. Returns the number removed."""
+        if not os.path.isdir(self.directory):
+            return 0
+        cutoff = time.time() - max_age_days * 24 * 60 * 60
+        removed = 0
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if not (name.startswith('user_') and name.endswith('.json')):
+                    continue
+                path = os.path.join(self.directory, name)
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+        if removed:
+            logger.info(f"Pruned {removed} old result files")
+        return removed
+
+class PrecomputeScheduler:
+    """
+    Tracks users whose transactions changed since their last run and
+    recomputes their predictions and budgets off-peak in a bounded
+    worker pool, most active users first.
+    """
+
+    def __init__(self, compute_functions, store,
+                 max_workers=2, offpeak_start=1, offpeak_end=6,
+                 poll_interval=300, max_pending=1000, result_max_age_days=30):
+        # compute_functions maps each section name to a callable taking a
+        # list of transactions and returning a JSON-able dict, or raising
+        # InsufficientDataError
+        self.compute_functions = compute_functions
+        self.store = store
+        self.max_workers = max_workers
+        self.offpeak_start = offpeak_start
+        self.offpeak_end = offpeak_end
+        self.poll_interval = poll_interval
+        self.max_pending = max_pending
+        self.result_max_age_days = result_max_age_days
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._in_flight = set()
+        self._registered = set()
+        self._executor = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def is_registered(self, user_id):
+        """Check whether the server has told us about this user"""
+        with self._lock:
+            if user_id in self._registered:
+                return True
+        return self.store.exists(user_id)
+
+    def record_activity(self, user_id, transactions, viewed=False):
+        """
+        Note the latest transactions for a user. The user is queued for
+        recomputation if any stored section is stale, and dropped from
+        the queue once every section is fresh. viewed marks a page view,
+        which raises the user's priority.
+        """
+        fingerprint = transactions_fingerprint(transactions)
+        ids = transaction_ids(transactions)
+        stored = self.store.load(user_id)
+
+        with self._lock:
+            self._registered.add(user_id)
+            if all(is_fresh(stored.get(s), fingerprint) for s in self.compute_functions):
+                self._pending.pop(user_id, None)
+                return fingerprint
+
+            previous = self._pending.get(user_id)
+            if previous is None and len(self._pending) >= self.max_pending:
+                logger.warning(f"Precompute queue is full, not queueing user {user_id}")
+                return fingerprint
+
+            # New transactions are the ones the last stored run did not see
+            seen = set()
+            for entry in stored.values():
+                seen.update(entry.get('transactionIds', []))
+
+            # Build a new job rather than updating the old one in place,
+            # since a worker may be running with the old job right now
+            self._pending[user_id] = {
+                'transactions': transactions,
+                'fingerprint': fingerprint,
+                'new_transactions': len(set(ids) - seen),
+                'hits': (previous['hits'] if previous else 0) + (1 if viewed else 0)
+            }
+        return fingerprint
+
+    def is_off_peak(self, now=None):
+        """Check whether the given time falls inside the off-peak window"""
+        hour = (now or datetime.now()).hour
+        if self.offpeak_start <= self.offpeak_end:
+            return self.offpeak_start <= hour < self.offpeak_end
+        # Window wraps past midnight, e.g. 22 -> 4
+        return hour >= self.offpeak_start or hour < self.offpeak_end
+
+    def run_pending(self, force=False):
+        """
+        Submit queued users to the worker pool, ordered by activity.
+        Returns the number of users submitted.
+        """
+        if not force and not self.is_off_peak():
+            return 0
+
+        with self._lock:
+            ready = [
+                (user_id, job) for user_id, job in self._pending.items()
+                if user_id not in self._in_flight
+            ]
+            # Most new transactions first, then most frequently viewed
+            ready.sort(key=lambda item: (item[1]['new_transactions'], item[1]['hits']),
+                       reverse=True)
+            for user_id, _ in ready:
+                self._in_flight.add(user_id)
+            if ready and self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        for user_id, job in ready:
+            self._executor.submit(self._run_user, user_id, job, force)
+
+        if ready:
+            logger.info(f"Scheduled precomputation for {len(ready)} users")
+        return len(ready)
+
+    def _run_user(self, user_id, job, force=False):
+        """Recompute every stale section for one user and store the results"""
+        fingerprint = job['fingerprint']
+        ids = transaction_ids(job['transactions'])
+
+        # The window may have closed while this job waited in the pool;
+        # leave it queued for the next night
+        if not force and not self.is_off_peak():
+            with self._lock:
+                self._in_flight.discard(user_id)
+            return
+
+        try:
+            for section, compute in self.compute_functions.items():
+                if self.store.lookup(user_id, section, fingerprint):
+                    continue
+                try:
+                    result = compute(job['transactions'])
+                except InsufficientDataError as e:
+                    # Store the failure so the user is not queued again
+                    # until their transactions change
+                    logger.info(f"Skipping {section} for user {user_id}: {e}")
+                    self.store.save_section(user_id, section, fingerprint, None, ids,
+                                            error=str(e))
+                    continue
+                self.store.save_section(user_id, section, fingerprint, result, ids)
+            logger.info(f"Precomputed results for user {user_id}")
+        except Exception:
+            logger.exception(f"Error precomputing results for user {user_id}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(user_id)
+                # Only clear the job if no newer transactions arrived meanwhile
+                current = self._pending.get(user_id)
+                if current and current['fingerprint'] == fingerprint:
+                    del self._pending[user_id]
+
+    def status(self):
+        """Return a summary of the scheduler state"""
+        with self._lock:
+            return {
+                'running': self._thread is not None and self._thread.is_alive(),
+                'pending': len(self._pending),
+                'inFlight': len(self._in_flight),
+                'offPeak': self.is_off_peak()
+            }
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.store.prune(self.result_max_age_days)
+                self.run_pending()
+            except Exception:
+                logger.exception("Error in precompute scheduler loop")
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """Start the background polling thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='precompute-scheduler',
+                                        daemon=True)
+        self._thread.start()
+        logger.info(f"Precompute scheduler started (off-peak {self.offpeak_start}:00-"
+                    f"{self.offpeak_end}:00, {self.max_workers} workers)")
+
+    def stop(self):
+        """Stop the polling thread and wait for running jobs"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
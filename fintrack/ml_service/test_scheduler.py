@@ -0,0 +1,188 @@
+import os
+import time
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from scheduler import (InsufficientDataError, PrecomputeScheduler, ResultStore,
+                       transaction_ids, transactions_fingerprint)
+
+def make_transactions(count, user=0, start=0):
+    return [
+        {'transaction_id': user * 1000 + i, 'transaction_date': '2019-01-01',
+         'amount': '10.00', 'category_name': 'Food', 'transaction_type': 'Expense'}
+        for i in range(start, start + count)
+    ]
+
+@pytest.fixture
+def store(tmp_path):
+    return ResultStore(str(tmp_path))
+
+def make_scheduler(store, compute=None, **kwargs):
+    compute = compute or (lambda transactions: {'count': len(transactions)})
+    return PrecomputeScheduler({'predictions': compute, 'budget': compute}, store, **kwargs)
+
+def test_is_off_peak_same_day_window(store):
+    scheduler = make_scheduler(store, offpeak_start=1, offpeak_end=6)
+    assert scheduler.is_off_peak(datetime(2025, 1, 1, 1))
+    assert scheduler.is_off_peak(datetime(2025, 1, 1, 5))
+    assert not scheduler.is_off_peak(datetime(2025, 1, 1, 6))
+    assert not scheduler.is_off_peak(datetime(2025, 1, 1, 0))
+
+def test_is_off_peak_window_wrapping_midnight(store):
+    scheduler = make_scheduler(store, offpeak_start=22, offpeak_end=4)
+    assert scheduler.is_off_peak(datetime(2025, 1, 1, 23))
+    assert scheduler.is_off_peak(datetime(2025, 1, 1, 0))
+    assert scheduler.is_off_peak(datetime(2025, 1, 1, 3))
+    assert not scheduler.is_off_peak(datetime(2025, 1, 1, 4))
+    assert not scheduler.is_off_peak(datetime(2025, 1, 1, 12))
+
+def test_run_pending_orders_by_activity(store):
+    order = []
+
+    def compute(transactions):
+        order.append(transactions[0]['transaction_id'] // 1000)
+        return {}
+
+    scheduler = PrecomputeScheduler({'predictions': compute}, store, max_workers=1)
+    scheduler.record_activity(1, make_transactions(2, user=1))
+    scheduler.record_activity(2, make_transactions(8, user=2))
+    scheduler.record_activity(3, make_transactions(2, user=3))
+    # Same number of new transactions as user 1, but viewed on the page
+    scheduler.record_activity(3, make_transactions(2, user=3), viewed=True)
+
+    assert scheduler.run_pending(force=True) == 3
+    scheduler.stop()
+
+    assert order == [2, 3, 1]
+    assert scheduler.status()['pending'] == 0
+
+def test_run_pending_waits_for_off_peak(store):
+    scheduler = make_scheduler(store, offpeak_start=0, offpeak_end=0)
+    scheduler.record_activity(1, make_transactions(3))
+    assert scheduler.run_pending() == 0
+    assert scheduler.status()['pending'] == 1
+
+def test_lookup_fresh_and_stale(store):
+    transactions = make_transactions(3)
+    fingerprint = transactions_fingerprint(transactions)
+    store.save_section(1, 'predictions', fingerprint, {'value': 1})
+
+    assert store.lookup(1, 'predictions', fingerprint)['result'] == {'value': 1}
+    # Transactions changed
+    assert store.lookup(1, 'predictions', transactions_fingerprint(make_transactions(4))) is None
+    # Computed on an earlier day
+    tomorrow = date.today() + timedelta(days=1)
+    assert store.lookup(1, 'predictions', fingerprint, today=tomorrow) is None
+    # Never computed
+    assert store.lookup(1, 'budget', fingerprint) is None
+
+def test_store_rejects_non_integer_user_ids(store):
+    with pytest.raises(ValueError):
+        store.load('../x')
+    with pytest.raises(TypeError):
+        store.load({'id': 1})
+
+def test_record_activity_skips_users_with_fresh_results(store):
+    scheduler = make_scheduler(store)
+    transactions = make_transactions(3)
+    scheduler.record_activity(1, transactions)
+    assert scheduler.status()['pending'] == 1
+
+    fingerprint = transactions_fingerprint(transactions)
+    store.save_section(1, 'predictions', fingerprint, {})
+    store.save_section(1, 'budget', fingerprint, {})
+    scheduler.record_activity(1, transactions)
+    assert scheduler.status()['pending'] == 0
+
+def test_run_user_keeps_job_requeued_while_running(store):
+    scheduler = make_scheduler(store)
+    scheduler.record_activity(1, make_transactions(3))
+    running_job = scheduler._pending[1]
+    scheduler._in_flight.add(1)
+
+    # New transactions arrive while the first job is computing
+    newer = make_transactions(4)
+    scheduler.record_activity(1, newer)
+    scheduler._run_user(1, running_job, force=True)
+
+    assert scheduler._pending[1]['fingerprint'] == transactions_fingerprint(newer)
+    assert 1 not in scheduler._in_flight
+
+def test_new_transactions_counts_ids_missing_from_stored_result(store):
+    scheduler = make_scheduler(store)
+    window = make_transactions(50)
+    store.save_section(1, 'predictions', transactions_fingerprint(window), {},
+                       transaction_ids(window))
+
+    # Two new transactions push the two oldest out of the fixed-size window
+    scheduler.record_activity(1, make_transactions(50, start=2))
+    assert scheduler._pending[1]['new_transactions'] == 2
+
+def test_only_page_views_count_as_hits(store):
+    scheduler = make_scheduler(store)
+    transactions = make_transactions(3)
+    scheduler.record_activity(1, transactions)
+    scheduler.record_activity(1, transactions)
+    assert scheduler._pending[1]['hits'] == 0
+
+    scheduler.record_activity(1, transactions, viewed=True)
+    assert scheduler._pending[1]['hits'] == 1
+
+def test_run_user_leaves_job_queued_after_off_peak_ends(store):
+    scheduler = make_scheduler(store, offpeak_start=0, offpeak_end=0)
+    scheduler.record_activity(1, make_transactions(3))
+    job = scheduler._pending[1]
+    scheduler._in_flight.add(1)
+
+    scheduler._run_user(1, job)
+
+    assert scheduler._pending[1] is job
+    assert 1 not in scheduler._in_flight
+    assert store.load(1) == {}
+
+def test_insufficient_data_is_stored_and_not_requeued(store):
+    def compute(transactions):
+        raise InsufficientDataError('No valid transaction data after processing')
+
+    scheduler = make_scheduler(store, compute=compute)
+    transactions = make_transactions(3)
+    scheduler.record_activity(1, transactions)
+    scheduler._in_flight.add(1)
+    scheduler._run_user(1, scheduler._pending[1], force=True)
+
+    assert store.load(1)['budget']['error'] == 'No valid transaction data after processing'
+    scheduler.record_activity(1, transactions)
+    assert scheduler.status()['pending'] == 0
+    # Changed transactions are tried again
+    scheduler.record_activity(1, make_transactions(4))
+    assert scheduler.status()['pending'] == 1
+
+def test_pending_queue_is_capped(store):
+    scheduler = make_scheduler(store, max_pending=2)
+    for user_id in range(3):
+        scheduler.record_activity(user_id, make_transactions(3, user=user_id))
+    assert sorted(scheduler._pending) == [0, 1]
+
+    # Users already queued can still be updated
+    scheduler.record_activity(1, make_transactions(4, user=1))
+    assert len(scheduler._pending[1]['transactions']) == 4
+
+def test_only_recorded_users_are_registered(store):
+    scheduler = make_scheduler(store)
+    assert not scheduler.is_registered(1)
+    scheduler.record_activity(1, make_transactions(3))
+    assert scheduler.is_registered(1)
+    # Users with stored results stay registered across restarts
+    store.save_section(2, 'predictions', 'abc', {})
+    assert make_scheduler(store).is_registered(2)
+
+def test_prune_removes_old_result_files(store, tmp_path):
+    store.save_section(1, 'predictions', 'abc', {})
+    store.save_section(2, 'predictions', 'abc', {})
+    old = time.time() - 40 * 24 * 60 * 60
+    os.utime(tmp_path / 'user_1.json', (old, old))
+
+    assert store.prune(30) == 1
+    assert not store.exists(1)
+    assert store.exists(2)
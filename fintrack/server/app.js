@@ -50,6 +50,7 @@ app.use('/api/analysis', analysisRouter);
 // });
 
 require('./cron/currencyUpdater');
+require('./cron/mlPrecompute');
 
 // Export the app for bin/www to use
 module.exports = app;
@@ -0,0 +1,35 @@
+const { pool: db } = require('../config/database');
+const { notifyMlService, getRecentLogins } = require('../db/ml_utils');
+const cron = require('node-cron');
+
+// Users who logged in or added transactions within this many days count as active
+const ACTIVE_DAYS = parseInt(process.env.ML_ACTIVE_DAYS || '7');
+
+// Forecasts are relative to the current date, so results expire daily.
+// Push recently active users' transactions just before the ML service's
+// off-peak window so it can recompute them overnight. Inactive users are
+// computed on demand if they come back.
+async function queueMlPrecompute() {
+  try {
+    const [rows] = await db.query(
+      `SELECT DISTINCT user_id FROM Transaction
+       WHERE transaction_date >= DATE_SUB(CURDATE(), INTERVAL ? DAY)`,
+      [ACTIVE_DAYS]
+    );
+    const users = new Set([...rows.map(row => row.user_id), ...getRecentLogins(ACTIVE_DAYS)]);
+
+    for (const userId of users) {
+      await notifyMlService(userId);
+    }
+
+    console.log(`Queued ML precomputation for ${users.size} active users`);
+  } catch (error) {
+    console.error('Error queueing ML precomputation:', error);
+  }
+}
+
+// Schedule to run every night at 00:30
+cron.schedule('30 0 * * *', () => {
+  console.log('Running scheduled ML precompute queueing...');
+  queueMlPrecompute();
+});
@@ -0,0 +1,63 @@
+const axios = require('axios');
+const { pool: db } = require('../config/database');
+
+const ML_SERVICE_URL = process.env.ML_SERVICE_URL || 'http://34.44.184.196:5001';
+// Shared secret the ML service checks on /api/ml/activity
+const ML_SERVICE_TOKEN = process.env.ML_SERVICE_TOKEN;
+
+// The analysis page sends the ML service the first page of
+// GET /api/transactions/user/:userId (default limit 50). We must send the
+// exact same rows, otherwise the precomputed results never match.
+const ML_TRANSACTION_LIMIT = 50;
+
+// Get the transactions the analysis page would send for a user
+async function getMlTransactions(userId) {
+  const [rows] = await db.query(
+    `SELECT t.*, c.category_name, c.category_type 
+     FROM Transaction t
+     JOIN Category c ON t.category_id = c.category_id
+     WHERE t.user_id = ?
+     ORDER BY t.transaction_date DESC, t.transaction_id DESC LIMIT ? OFFSET ?`,
+    [userId, ML_TRANSACTION_LIMIT, 0]
+  );
+  return rows;
+}
+
+// Tell the ML service about a user's latest transactions so it can
+// precompute their predictions and budgets off-peak
+async function notifyMlService(userId) {
+  try {
+    const transactions = await getMlTransactions(userId);
+    if (transactions.length === 0) {
+      return;
+    }
+    await axios.post(`${ML_SERVICE_URL}/api/ml/activity`, {
+      userId: parseInt(userId),
+      transactions
+    }, {
+      headers: ML_SERVICE_TOKEN ? { 'X-ML-Token': ML_SERVICE_TOKEN } : {}
+    });
+  } catch (error) {
+    console.error(`Error notifying ML service for user ${userId}:`, error.message);
+  }
+}
+
+// Last login time per user, used to pick who the nightly job refreshes
+const lastLogins = new Map();
+
+function recordLogin(userId) {
+  lastLogins.set(parseInt(userId), Date.now());
+}
+
+// Users who logged in within the last `days` days
+function getRecentLogins(days) {
+  const cutoff = Date.now() - days * 24 * 60 * 60 * 1000;
+  return [...lastLogins].filter(([, time]) => time >= cutoff).map(([userId]) => userId);
+}
+
+module.exports = {
+  getMlTransactions,
+  notifyMlService,
+  recordLogin,
+  getRecentLogins
+};
@@ -2,6 +2,7 @@ const express = require('express');
 const router = express.Router();
 const { pool: db } = require('../config/database');
 const { executeTransaction, transferBetweenSavingsGoals, batchProcessTransactions } = require('../db/transaction_utils');
+const { notifyMlService } = require('../db/ml_utils');
 
 // Call stored procedure to analyze user spending
 router.get('/spending/:userId', async (req, res) => {
@@ -65,6 +66,7 @@ router.post('/transfer-savings', async (req, res) => {
     
     // Execute transaction
     await transferBetweenSavingsGoals(userId, fromGoalId, toGoalId, amount);
+    notifyMlService(userId);
     
     res.status(200).json({ message: 'Transfer completed successfully' });
   } catch (error) {
@@ -85,6 +87,7 @@ router.post('/batch-transactions', async (req, res) => {
     
     // Execute batch transaction
     await batchProcessTransactions(userId, transactions);
+    notifyMlService(userId);
     
     res.status(200).json({ message: 'Batch processed successfully' });
   } catch (error) {
@@ -1,6 +1,7 @@
 const express = require('express');
 const router = express.Router();
 const { pool: db } = require('../config/database');
+const { notifyMlService } = require('../db/ml_utils');
 
 // Get all transactions for a user
 router.get('/user/:userId', async (req, res) => {
@@ -42,7 +43,8 @@ router.get('/user/:userId', async (req, res) => {
       queryParams.push(currency);
     }
     
-    query += ' ORDER BY t.transaction_date DESC LIMIT ? OFFSET ?';
+    // Keep this ordering in sync with getMlTransactions in db/ml_utils.js
+    query += ' ORDER BY t.transaction_date DESC, t.transaction_id DESC LIMIT ? OFFSET ?';
     queryParams.push(parseInt(limit), parseInt(offset));
     
     const [rows] = await db.query(query, queryParams);
@@ -169,6 +171,9 @@ router.post('/', async (req, res) => {
       [user_id, category_id, amount, currency_code, transaction_date, transaction_type, description]
     );
     
+    // Let the ML service precompute this user's results in the background
+    notifyMlService(user_id);
+    
     res.status(201).json({ 
       transaction_id: result.insertId,
       user_id,
@@ -205,6 +210,14 @@ router.put('/:transactionId', async (req, res) => {
       [category_id, amount, currency_code, transaction_date, transaction_type, description, req.params.transactionId]
     );
     
+    const [owners] = await db.query(
+      'SELECT user_id FROM Transaction WHERE transaction_id = ?',
+      [req.params.transactionId]
+    );
+    if (owners.length > 0) {
+      notifyMlService(owners[0].user_id);
+    }
+    
     res.json({ 
       transaction_id: parseInt(req.params.transactionId),
       category_id,
@@ -223,8 +236,18 @@ router.put('/:transactionId', async (req, res) => {
 // Delete a transaction
 router.delete('/:transactionId', async (req, res) => {
   try {
+    // Look up the owner first so the ML service can be told afterwards
+    const [owners] = await db.query(
+      'SELECT user_id FROM Transaction WHERE transaction_id = ?',
+      [req.params.transactionId]
+    );
+    
     await db.query('DELETE FROM Transaction WHERE transaction_id = ?', [req.params.transactionId]);
     
+    if (owners.length > 0) {
+      notifyMlService(owners[0].user_id);
+    }
+    
     res.json({ message: 'Transaction deleted successfully' });
   } catch (error) {
     console.error('Error deleting transaction:', error);
@@ -2,6 +2,7 @@ const express = require('express');
 const router = express.Router();
 const { pool: db } = require('../config/database');
 const bcrypt = require('bcrypt');
+const { notifyMlService, recordLogin } = require('../db/ml_utils');
 
 // Get all users
 router.get('/', async (req, res) => {
@@ -96,6 +97,10 @@ router.post('/login', async (req, res) => {
       return res.status(401).json({ message: 'Invalid credentials' });
     }
     
+    // Register the user with the ML service so their results get precomputed
+    recordLogin(user.user_id);
+    notifyMlService(user.user_id);
+    
     // Don't send password_hash to client
     const { password_hash, ...userWithoutPassword } = user;
     res.json(userWithoutPassword);